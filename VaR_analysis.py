@@ -2,39 +2,42 @@ import pandas as pd
 import numpy as np
 from data import StockDatabase
 import pandas_market_calendars as mcal
+from scipy.stats import norm
 
 
 # VaR Analysis   
-def calculate_portfolio_variance(weights: np.ndarray, cov_matrix: pd.DataFrame) -> float:
+def calculate_portfolio_variance(weights: np.ndarray, cov_matrix: np.ndarray) -> float | np.ndarray:
     """
     Calculate the portfolio variance given weights and covariance matrix.
     
     Parameters:
-    weights (np.ndarray): Array of asset weights in the portfolio.
-    cov_matrix (pd.DataFrame): Covariance matrix of asset returns.
+    weights (np.ndarray): Array of asset weights in the portfolio, or a 2D array with the
+    weights of one portfolio (e.g. one date) per row.
+    cov_matrix (np.ndarray): Covariance matrix of asset returns.
     
     Returns:
-    float: Portfolio variance.
+    float | np.ndarray: Portfolio variance, or an array with the variance of each row.
     """
-    return np.dot(weights.T, np.dot(cov_matrix, weights))
+    return np.einsum('...i,ij,...j->...', weights, cov_matrix, weights)
 
-def calculate_VaR(weights: np.ndarray, cov_matrix: pd.DataFrame, alpha: float = 0.01) -> float:
+def calculate_VaR(weights: np.ndarray, cov_matrix: np.ndarray, alpha: float = 0.01) -> float | np.ndarray:
     """
     Calculate the Value at Risk (VaR) of a portfolio.
     
     Parameters:
-    weights (np.ndarray): Array of asset weights in the portfolio.
-    cov_matrix (pd.DataFrame): Covariance matrix of asset returns.
+    weights (np.ndarray): Array of asset weights in the portfolio, or a 2D array with the
+    weights of one portfolio (e.g. one date) per row.
+    cov_matrix (np.ndarray): Covariance matrix of asset returns.
     alpha (float): Significance level for VaR calculation (default is 0.01).
     
     Returns:
-    float: Value at Risk of the portfolio.
+    float | np.ndarray: Value at Risk of the portfolio, or an array with the VaR of each row.
     """
     portfolio_variance = calculate_portfolio_variance(weights, cov_matrix)
     portfolio_std_dev = np.sqrt(portfolio_variance)
     
     # Calculate VaR using the normal distribution quantile function
-    VaR = -portfolio_std_dev * np.percentile(np.random.normal(0, 1, 100000), 100 * alpha)
+    VaR = -portfolio_std_dev * norm.ppf(alpha)
     
     return VaR
 
@@ -50,14 +53,10 @@ def calculate_weights(PERMNOs: list, asset_history: pd.DataFrame) -> pd.DataFram
     Returns:
     weights (pd.DataFrame): DataFrame of weights for each asset in the portfolio for each date.
     """
-    weights_df = pd.DataFrame(index=asset_history['timestamp'].unique(), columns=PERMNOs)
-
-    for PERMNO in PERMNOs:
-        value = asset_history[asset_history['PERMNO'] == PERMNO].set_index('timestamp')["value"]
-        weights_df[PERMNO] = value
-    
-    weights_df = weights_df.infer_objects(copy=False)
-    weights_df = weights_df.fillna(0)
+    # one pivot pass over the history instead of a boolean mask per PERMNO
+    weights_df = asset_history.pivot_table(index='timestamp', columns='PERMNO', values='value',
+                                           aggfunc='sum', fill_value=0)
+    weights_df = weights_df.reindex(columns=PERMNOs, fill_value=0)
     # Normalize weights to sum to 1
     weights_df = weights_df.div(weights_df.abs().sum(axis=1), axis=0)
 
@@ -67,7 +66,9 @@ def calculate_weights(PERMNOs: list, asset_history: pd.DataFrame) -> pd.DataFram
 sd = StockDatabase()
 nyse = mcal.get_calendar("NYSE")
 windows = pd.read_csv("windows.csv")
-VaR_df = pd.DataFrame()
+# VaR of each date, collected across windows and assembled into a DataFrame once at the end
+VaR_dates = []
+VaR_values = []
 
 for i in range(len(windows)):
     print("Processing window:", i+1, "of", len(windows))
@@ -78,20 +79,20 @@ for i in range(len(windows)):
     PERMNOs = list({str(PERMNO) for pairs in df.index.tolist() for PERMNO in pairs})
 
     # get the returns data for the PERMNOs
-    returns = pd.DataFrame()
-    for PERMNO in PERMNOs:
-        data = sd.get_metrics(PERMNO, ("C",), train_start, train_end)
-        returns[PERMNO] = data['DlyClose'].pct_change().dropna()
+    closes = pd.concat({PERMNO: sd.get_metrics(PERMNO, ("C",), train_start, train_end)["DlyClose"] for PERMNO in PERMNOs},
+                       axis=1)
+    returns = closes.pct_change().dropna(how="all")
     
     # calculate the VaR
-    cov_matrix = returns.cov()
+    cov_matrix = returns.cov().to_numpy()
     asset_history = pd.read_csv(f"results/asset_history/asset_history_for_{test_start}.csv")
     weights_df = calculate_weights(PERMNOs, asset_history)
 
-    for date in weights_df.index:
-        weight = weights_df.loc[date].values
-        VaR = calculate_VaR(weight, cov_matrix, alpha=0.05)
-        VaR_df.loc[date, 'VaR'] = VaR
+    # VaR of every date in the window in a single pass over the weights matrix
+    VaR = calculate_VaR(weights_df.to_numpy(), cov_matrix, alpha=0.05)
+    VaR_dates.extend(weights_df.index)
+    VaR_values.extend(VaR)
     
 # save the VaR data
+VaR_df = pd.DataFrame({"VaR": VaR_values}, index=VaR_dates)
 VaR_df.to_csv("results/VaR_05.csv", index=True)
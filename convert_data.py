@@ -0,0 +1,23 @@
+import os
+import pandas as pd
+from data import PRICE_DTYPES, cast_volumes
+
+
+# One-off migration of the per-PERMNO csvs into a single Parquet dataset partitioned by PERMNO,
+# which StockDatabase reads instead of the csvs once it exists.
+identifiers = pd.read_csv("data/identifiers.csv")
+
+frames = []
+for PERMNO in identifiers["PERMNO"].unique():
+    if not os.path.exists(f"data/{PERMNO}.csv"):
+        continue
+    df = pd.read_csv(f"data/{PERMNO}.csv", dtype=PRICE_DTYPES)
+    df["DlyVol"] = cast_volumes(df["DlyVol"])
+    df["DlyCalDt"] = pd.to_datetime(df["DlyCalDt"], format="%Y-%m-%d")
+    df.sort_values("DlyCalDt", inplace=True)
+    df["PERMNO"] = PERMNO
+    frames.append(df)
+
+prices = pd.concat(frames, ignore_index=True)
+prices.to_parquet("data/prices.parquet", partition_cols=["PERMNO"], index=False)
+print(f"Wrote {len(frames)} PERMNOs to data/prices.parquet")
@@ -1,4 +1,25 @@
+import os
+import numpy as np
 import pandas as pd
+import pyarrow.dataset as ds
+
+
+# prices and market caps are stored in single precision, which halves the memory of the cached frames
+PRICE_DTYPES = {"DlyOpen": "float32",
+                "DlyHigh": "float32",
+                "DlyLow": "float32",
+                "DlyClose": "float32",
+                "DlyCap": "float32"}
+
+
+def cast_volumes(volumes: pd.Series) -> pd.Series:
+    """
+    Returns the daily volumes as uint32, so that every PERMNO gets the same dtype, or as float64 if
+    they contain missing values or don't fit in uint32.
+    """
+    if volumes.notna().all() and volumes.min() >= 0 and volumes.max() <= np.iinfo(np.uint32).max:
+        return volumes.astype(np.uint32)
+    return volumes.astype(np.float64)
 
 
 class StockDatabase():
@@ -19,6 +40,13 @@ class StockDatabase():
     def __init__(self):
         self.identifers = pd.read_csv("data/identifiers.csv")
         self.metrics = {}
+        # hash indexes of the identifiers, built by build_identifier_indexes on the first lookup
+        self.identifiers_by_PERMNO = None
+        self.identifiers_by_ticker = None
+        # consolidated price dataset written by convert_data.py (falls back to the per-PERMNO csvs)
+        self.prices = None
+        if os.path.exists("data/prices.parquet"):
+            self.prices = ds.dataset("data/prices.parquet", partitioning="hive")
 
 
     def search_PERMNO(self, ticker: str, date: str) -> int:
@@ -26,21 +54,25 @@ class StockDatabase():
         Returns the PERMNO (identifier) of the ticker on the given date.
         Returns None if can't find the ticker.
         """
-        mask = (self.identifers["Ticker"] == ticker) & (self.identifers["SecurityBegDt"] <= date) & (self.identifers["SecurityEndDt"] >= date)
-        row = self.identifers[mask]
-        if row.empty:
-            raise ValueError(f"Ticker {ticker} not found on date {date}")
-        return row["PERMNO"].values[0]
+        if self.identifiers_by_ticker is None:
+            self.build_identifier_indexes()
+        for begin, end, PERMNO in self.identifiers_by_ticker.get(ticker, []):
+            if begin <= date <= end:
+                return PERMNO
+        raise ValueError(f"Ticker {ticker} not found on date {date}")
   
 
     def range_PERMNO(self, PERMNO: int) -> tuple:
         """
         Returns the start and end dates of the PERMNO.
         """
-        row = self.identifers.loc[self.identifers["PERMNO"] == PERMNO]
-        if row.empty:
+        if self.identifiers_by_PERMNO is None:
+            self.build_identifier_indexes()
+        row = self.identifiers_by_PERMNO.get(PERMNO)
+        if row is None:
             raise ValueError(f"PERMNO {PERMNO} not found in the dataset.")
-        return row["SecurityBegDt"].values[0], row["SecurityEndDt"].values[0]
+        begin, end, _ = row
+        return begin, end
     
 
     def get_active_PERMNOs(self, start_date: str, end_date: str) -> list:
@@ -55,10 +87,13 @@ class StockDatabase():
         """
         Returns the security name for the given PERMNO.
         """
-        row = self.identifers.loc[self.identifers["PERMNO"] == PERMNO]
-        if row.empty:
+        if self.identifiers_by_PERMNO is None:
+            self.build_identifier_indexes()
+        row = self.identifiers_by_PERMNO.get(PERMNO)
+        if row is None:
             raise ValueError(f"PERMNO {PERMNO} not found in the dataset.")
-        return row["SecurityNm"].values[0]
+        _, _, name = row
+        return name
 
 
     def get_metrics(self, PERMNO: int, metrics: tuple, start_date: str, end_date: str) -> pd.DataFrame:
@@ -77,6 +112,23 @@ class StockDatabase():
 
 
     # HELPER
+    def build_identifier_indexes(self) -> None:
+        """
+        Builds the hash indexes of the identifiers, so lookups by PERMNO or ticker don't scan the
+        whole table. A PERMNO keeps its first row as (begin, end, name), and a ticker keeps its rows
+        in file order as (begin, end, PERMNO).
+        """
+        first_rows = self.identifers.drop_duplicates("PERMNO")
+        self.identifiers_by_PERMNO = dict(zip(first_rows["PERMNO"].tolist(),
+                                              zip(first_rows["SecurityBegDt"].tolist(),
+                                                  first_rows["SecurityEndDt"].tolist(),
+                                                  first_rows["SecurityNm"].tolist())))
+        self.identifiers_by_ticker = {}
+        columns = ["Ticker", "SecurityBegDt", "SecurityEndDt", "PERMNO"]
+        for ticker, begin, end, PERMNO in zip(*(self.identifers[column].tolist() for column in columns)):
+            self.identifiers_by_ticker.setdefault(ticker, []).append((begin, end, PERMNO))
+
+
     def get_PERMNO(self, PERMNO: int) -> pd.DataFrame:
         """
         Return the OHLCVs csv for the PERMNO. If does not exist, then raises Error.
@@ -84,8 +136,19 @@ class StockDatabase():
         if PERMNO in self.metrics:
             return self.metrics[PERMNO]
 
+        if self.prices is not None:
+            # the PERMNO partition is selected by the filter, and the dates are already typed and sorted
+            df = self.prices.to_table(filter=ds.field("PERMNO") == int(PERMNO)).to_pandas()
+            if df.empty:
+                raise FileNotFoundError(f"The PERMNO {PERMNO} does not exist in the database.")
+            # the row order is not guaranteed to survive the partitioned write, so sort like the csvs
+            df = df.drop(columns="PERMNO").set_index("DlyCalDt").sort_index()
+            self.metrics[PERMNO] = df
+            return self.metrics[PERMNO]
+
         try:
-            df = pd.read_csv(f"data/{PERMNO}.csv")
+            df = pd.read_csv(f"data/{PERMNO}.csv", dtype=PRICE_DTYPES)
+            df["DlyVol"] = cast_volumes(df["DlyVol"])
             df["DlyCalDt"] = pd.to_datetime(df["DlyCalDt"], format="%Y-%m-%d")
             df.set_index("DlyCalDt", inplace=True)
             df.sort_index(inplace=True)
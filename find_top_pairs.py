@@ -3,27 +3,32 @@ import numpy as np
 from data import StockDatabase
 import pandas_market_calendars as mcal
 from statsmodels.tsa.stattools import coint
+from joblib import Parallel, delayed
 
 windows = pd.read_csv("windows.csv", parse_dates=["train_start", "train_end", "test_start", "test_end"])
 sd = StockDatabase()
+# NYSE schedule of the whole database range, sliced per window instead of rebuilt
+nyse_schedule = mcal.get_calendar("NYSE").schedule(start_date="2010-01-01", end_date="2024-12-31")
 
 for index, row in windows.iterrows():
     # Step 1: preprocess the data to find top 1000 stocks
     start_date = row["train_start"].strftime("%Y-%m-%d")
     end_date = row["train_end"].strftime("%Y-%m-%d")
     test_date = row["test_start"].strftime("%Y-%m-%d")
-    num_trading_days = len(mcal.get_calendar("NYSE").schedule(start_date=start_date, end_date=end_date))
+    num_trading_days = len(nyse_schedule.loc[start_date:end_date])
     activePERMNOs = sd.get_active_PERMNOs(start_date, end_date)
     # print(f"Found {len(activePERMNOs)} active PERMNOs between {start_date} and {end_date}.")
 
 
     liquidPERMNOs = []
+    closes = {}  # close prices of the liquid PERMNOs, reused in Step 2
     for PERMNO in activePERMNOs:
         data = sd.get_metrics(PERMNO, ("Cap", "C"), start_date, end_date)
         cap = data["DlyCap"]
         close = data["DlyClose"]
         if len(close) == num_trading_days and not close.isna().any():
             liquidPERMNOs.append((PERMNO, cap.mean()))
+            closes[PERMNO] = close
     # pick top 1000 liquid stocks by average market cap
     liquidPERMNOs = sorted(liquidPERMNOs, key=lambda x: x[1], reverse=True)[:1000]
     liquidPERMNOs = [x[0] for x in liquidPERMNOs]  # extract PERMNOs only
@@ -39,27 +44,28 @@ for index, row in windows.iterrows():
         log_prices : DataFrame of log prices for the given PERMNOs
         threshold : float, correlation threshold
         """
-        pairs = []
-        correlation_matrix = log_prices[PERMNOs].corr()
-        for i in range(len(PERMNOs)):
-            for j in range(i + 1, len(PERMNOs)):
-                if correlation_matrix.iloc[i, j] > threshold:
-                    pairs.append((PERMNOs[i], PERMNOs[j]))
-        return pairs
-
-    log_price_list = []
-    for PERMNO in liquidPERMNOs:
-        data = sd.get_metrics(PERMNO, ("C"), start_date, end_date)
-        log_price_list.append(np.log(data["DlyClose"]).rename(PERMNO))
-    log_prices = pd.concat(log_price_list, axis=1)
+        correlation_matrix = log_prices[PERMNOs].corr().to_numpy()
+        # upper triangle (i < j) of the matrix, in the same row-major order as a double loop
+        rows, cols = np.triu_indices(len(PERMNOs), k=1)
+        mask = correlation_matrix[rows, cols] > threshold
+        PERMNOs = np.asarray(PERMNOs)
+        return list(zip(PERMNOs[rows[mask]].tolist(), PERMNOs[cols[mask]].tolist()))
+
+    log_prices = np.log(pd.concat({PERMNO: closes[PERMNO] for PERMNO in liquidPERMNOs}, axis=1).astype(np.float64))
     pairs = get_pairs_by_correlation(liquidPERMNOs, log_prices, 0.95)
     print(f"Found {len(pairs)} pairs with correlation above threshold.")
 
 
-    # Step 3: Cointegration test
+    # log prices as a numpy matrix with a PERMNO -> column map, shared by the pair loops of Steps 3 and 5
+    lp = log_prices[liquidPERMNOs].to_numpy(dtype=np.float64)
+    col = {PERMNO: i for i, PERMNO in enumerate(liquidPERMNOs)}
+
+
+    # Step 3: Cointegration test (pairs are independent, so the tests run in parallel)
+    results = Parallel(n_jobs=-1)(delayed(coint)(lp[:, col[PERMNO1]], lp[:, col[PERMNO2]])
+                                  for PERMNO1, PERMNO2 in pairs)
     cointegrated_pairs = {}
-    for PERMNO1, PERMNO2 in pairs:
-        _, p_value, _ = coint(log_prices[PERMNO1], log_prices[PERMNO2])
+    for (PERMNO1, PERMNO2), (_, p_value, _) in zip(pairs, results):
         if p_value < 0.05:
             cointegrated_pairs[(PERMNO1, PERMNO2)] = {"p_value": p_value}
     
@@ -70,25 +76,26 @@ for index, row in windows.iterrows():
     
     
     # Step 5: Calculate alpha, beta, and spread std
-    def calc_spread(PERMNO1, PERMNO2, log_prices):
+    def calc_spread(y, x):
         """
         returns the log spread between the two PERMNOs over the given date range, alpha, and beta. 
-        PERMNO1 is y and PERMNO2 is x in the regression model.
+        y is the array of log prices of PERMNO1 and x is the array of log prices of PERMNO2 in the
+        regression model.
         
         The spread is calculated as:
         spread = y - alpha * x - beta
         where alpha and beta are the coefficients from the OLS regression.
         """
-        y = log_prices[PERMNO1]
-        x = log_prices[PERMNO2]
-        
-        # OLS regression to find the spread
-        alpha, beta = np.polyfit(x, y, 1)
+        # OLS regression to find the spread, in closed form: alpha = cov(x, y) / var(x)
+        x_mean, y_mean = x.mean(), y.mean()
+        x_dev = x - x_mean
+        alpha = np.dot(x_dev, y - y_mean) / np.dot(x_dev, x_dev)
+        beta = y_mean - alpha * x_mean
         spread = y - alpha * x - beta
         return spread, alpha, beta
 
     for (PERMNO1, PERMNO2) in top_pairs.keys():
-        spread, alpha, beta = calc_spread(PERMNO1, PERMNO2, log_prices)
+        spread, alpha, beta = calc_spread(lp[:, col[PERMNO1]], lp[:, col[PERMNO2]])
         spread_sd = np.std(spread)
         top_pairs[(PERMNO1, PERMNO2)].update({"alpha": alpha, "beta": beta, "spread_sd": spread_sd})
 
@@ -5,7 +5,8 @@ from trading_model import TradingModel
 from simulation import Account
 
 
-nyse = mcal.get_calendar("NYSE")
+# NYSE schedule of the whole database range, sliced per window instead of rebuilt
+nyse_schedule = mcal.get_calendar("NYSE").schedule(start_date="2010-01-01", end_date="2024-12-31")
 windows = pd.read_csv("windows.csv")
 returns = []
 
@@ -31,22 +32,35 @@ for i in range(len(windows)):
     model = TradingModel(pairs, OLS_coeff, threshold, stop_loss)
 
     # simulate trading for a month
-    schedule = nyse.schedule(start_date=train_end, end_date=test_end)
+    schedule = nyse_schedule.loc[train_end:test_end]
     trading_days = schedule.index.strftime("%Y-%m-%d").tolist()
 
+    # align the close and open prices of the model's PERMNOs to the trading days once per window,
+    # so that each simulated day reads a row of an array instead of querying every PERMNO
+    PERMNOs = list(model.sorted_PERMNOs)
+    closes = np.column_stack([model.get_PERMNO(PERMNO)["DlyClose"].reindex(schedule.index).to_numpy(dtype=np.float64)
+                              for PERMNO in PERMNOs])
+    opens = np.column_stack([model.get_PERMNO(PERMNO)["DlyOpen"].reindex(schedule.index).to_numpy(dtype=np.float64)
+                             for PERMNO in PERMNOs])
+    last_close_dates = {PERMNO: model.get_PERMNO(PERMNO).index[-2] for PERMNO in PERMNOs}
+    # log spreads of every pair on every day of the window
+    spreads = model.calc_spreads_matrix(closes)
+
     account = Account(trading_days[0], 20)
+    account.load_prices(model.unique_PERMNOs)
     unique_trades = set()
     for i in range(1, len(trading_days)-1):  
         previous_day = trading_days[i-1]
         current_day = trading_days[i]
 
         # make decision based on previous day's closing prices
-        decisions = model.make_decisions(previous_day)
+        decisions = model.make_decisions_from_spreads(previous_day, spreads[i-1], last_close_dates)
         # update unique trades
         unique_trades.update([pair for pair, position in decisions if position != 0])
 
         # make trades on current day opening prices
-        trades = model.trade(decisions, current_day)
+        open_prices = dict(zip(PERMNOs, opens[i].tolist()))
+        trades = model.trade_helper(decisions, open_prices)
         
         # update account with trades
         account.update_date(current_day)
@@ -1,3 +1,4 @@
+import math
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
@@ -13,7 +14,7 @@ class Account(StockDatabase):
     buying and selling stocks, and shorting stocks (does not consider transaction fees).
 
     Methods:
-    update_date(date: str) -> None:
+    update_date(date: str | pd.Timestamp) -> None:
         Updates the date of the account to the given date.
     make_transaction(transactions: list) -> None:
         Makes a transaction given a list of transactions as a tuple of (PERMNO, quantity).
@@ -26,30 +27,46 @@ class Account(StockDatabase):
         Returns the transaction history as a pandas DataFrame.
     get_capital_history() -> pd.DataFrame:
         Returns the capital history as a pandas DataFrame.
+    load_prices(PERMNOs: list) -> None:
+        Preloads the open prices of the PERMNOs so that price lookups skip pandas indexing.
     """
+    # NYSE trading days covered by the database, built once instead of on every update_date call
+    TRADING_INDEX = mcal.get_calendar("NYSE").schedule(start_date="2010-01-01", end_date="2024-12-31").index
+    TRADING_DAYS = frozenset(TRADING_INDEX.strftime("%Y-%m-%d"))
+    # row of each trading day in the open price arrays built by load_prices
+    DATE_TO_ROW = {date: row for row, date in enumerate(TRADING_INDEX.strftime("%Y-%m-%d"))}
+
     def __init__(self, start_date, buying_power):
         super().__init__()
-        self.date = start_date
+        # the date is kept as an ISO string, which compares chronologically and is recorded as is
+        self.date = pd.Timestamp(start_date).strftime("%Y-%m-%d")
+        # row of the date in the open price arrays (None if it is not a trading day)
+        self.date_row = self.DATE_TO_ROW.get(self.date)
         self.buying_power = buying_power
         self.assets = {}
         self.capital = buying_power
-        self.transaction_history = []
-        self.capital_history = []
-        self.asset_history = []
+        # histories are stored column-wise and only assembled into DataFrames on request
+        self.transaction_history = {"timestamp": [], "PERMNO": [], "quantity": [], "price": []}
+        self.capital_history = {"timestamp": [], "capital": []}
+        self.asset_history = {"timestamp": [], "PERMNO": [], "quantity": [], "value": []}
+        # open prices of each PERMNO aligned to TRADING_INDEX, e.g. {PERMNO: np.ndarray}
+        self.opens = {}
+
 
+    def update_date(self, date: str | pd.Timestamp) -> None:
+        if not isinstance(date, str):
+            date = date.strftime("%Y-%m-%d")
 
-    def update_date(self, date: str) -> None:
-        # check if date is moving forward
-        if pd.to_datetime(date) < pd.to_datetime(self.date):
+        # check if date is moving forward (dates are ISO formatted, so strings compare chronologically)
+        if date < self.date:
             raise ValueError(f"Date {date} must be after the current date {self.date}.")
         
         # check if date is a trading day
-        nyse = mcal.get_calendar("NYSE")
-        schedule = nyse.schedule(start_date=date, end_date=date)
-        if schedule.empty:
+        if date not in self.TRADING_DAYS:
             raise ValueError(f"{date} is not a trading day.")
         
         self.date = date
+        self.date_row = self.DATE_TO_ROW[date]
     
 
     def make_transaction(self, transactions: list, negative_balance = False) -> None:
@@ -58,23 +75,25 @@ class Account(StockDatabase):
         [(PERMNO, quantity), (PERMNO, quantity), ...] where quantity can be negative for selling.
         If negative_balance is True, allows the buying power to go negative.
         """
+        assets = self.assets
         for PERMNO, quantity in transactions:
             price = self.get_price(PERMNO)
 
             # updating buying power and assets
-            self.buying_power -= quantity * price    
-            if PERMNO in self.assets:
-                self.assets[PERMNO] += quantity
-                if np.isclose(self.assets[PERMNO], 0, atol=1e-10):
-                    del self.assets[PERMNO]
+            self.buying_power -= quantity * price
+            held = assets.get(PERMNO)
+            if held is None:
+                assets[PERMNO] = quantity
             else:
-                self.assets[PERMNO] = quantity
+                held += quantity
+                # plain scalar compare, same tolerance as np.isclose(quantity, 0, atol=1e-10)
+                if abs(held) <= 1e-10:
+                    del assets[PERMNO]
+                else:
+                    assets[PERMNO] = held
             
             # record transaction
-            self.transaction_history.append({"timestamp": self.date,
-                                             "PERMNO": PERMNO,
-                                             "quantity": quantity,
-                                             "price": price})
+            self.record_transaction(PERMNO, quantity, price)
     
         
         # check if buying power is still positive, otherwise bad transaction
@@ -90,10 +109,7 @@ class Account(StockDatabase):
         for PERMNO, quantity in self.assets.items():
             price = self.get_price(PERMNO)
             self.buying_power += quantity * price
-            self.transaction_history.append({"timestamp": self.date,
-                                             "PERMNO": PERMNO,
-                                             "quantity": -quantity,
-                                             "price": price})
+            self.record_transaction(PERMNO, -quantity, price)
         # clear assets
         self.assets.clear()
 
@@ -107,13 +123,13 @@ class Account(StockDatabase):
         """
         asset_value = 0
         for PERMNO, quantity in self.assets.items():
-            price = self.get_price(PERMNO)
-            value = quantity * price
+            value = quantity * self.get_price(PERMNO)
             asset_value += value
-            self.asset_history.append({"timestamp": self.date, "PERMNO": PERMNO, "quantity": quantity, "value": value})
-        self.asset_history.append({"timestamp": self.date, "PERMNO": "CASH", "quantity": 1, "value": self.buying_power})
+            self.record_asset(PERMNO, quantity, value)
+        self.record_asset("CASH", 1, self.buying_power)
         self.capital = self.buying_power + asset_value
-        self.capital_history.append({"timestamp": self.date, "capital": self.capital})
+        self.capital_history["timestamp"].append(self.date)
+        self.capital_history["capital"].append(self.capital)
 
 
     def get_transaction_history(self) -> pd.DataFrame:
@@ -133,17 +149,54 @@ class Account(StockDatabase):
 
     def calc_total_return(self) -> float:
         """Calculates the return of the account from start to end date"""
-        return (self.capital_history[-1]["capital"] - self.capital_history[0]["capital"]) / self.capital_history[0]["capital"]
+        capital = self.capital_history["capital"]
+        return (capital[-1] - capital[0]) / capital[0]
 
 
     # HELPER
+    def record_transaction(self, PERMNO: int, quantity: float, price: float) -> None:
+        """
+        Appends a transaction on the current date to the transaction history columns.
+        """
+        self.transaction_history["timestamp"].append(self.date)
+        self.transaction_history["PERMNO"].append(PERMNO)
+        self.transaction_history["quantity"].append(quantity)
+        self.transaction_history["price"].append(price)
+
+
+    def record_asset(self, PERMNO, quantity: float, value: float) -> None:
+        """
+        Appends an asset holding on the current date to the asset history columns.
+        """
+        self.asset_history["timestamp"].append(self.date)
+        self.asset_history["PERMNO"].append(PERMNO)
+        self.asset_history["quantity"].append(quantity)
+        self.asset_history["value"].append(value)
+
+
     def get_price(self, PERMNO: int) -> float:
         """
         Returns the price of the PERMNO on the current date.
         """
-        data = self.get_metrics(PERMNO, ("O"), self.date, self.date)
-
-        if data.empty or pd.isna(data.iloc[0, 0]):
+        opens = self.opens.get(PERMNO)
+        if opens is None:
+            self.load_prices([PERMNO])
+            opens = self.opens[PERMNO]
+
+        # math.isnan on the scalar avoids the dispatch cost of pd.isna on this hot path
+        price = np.nan if self.date_row is None else opens[self.date_row]
+        if math.isnan(price):
             raise ValueError(f"Not a trading day for {PERMNO} on {self.date}")
-        return data.iloc[0, 0]
+        return price
+
+
+    def load_prices(self, PERMNOs: list) -> None:
+        """
+        Loads the open prices of the PERMNOs as arrays aligned to the NYSE trading days, so that
+        get_price is a dictionary lookup and an array read instead of a DataFrame slice.
+        """
+        for PERMNO in PERMNOs:
+            opens = self.get_PERMNO(PERMNO)["DlyOpen"].reindex(self.TRADING_INDEX)
+            # upcast so that buying power and capital are accumulated in double precision
+            self.opens[PERMNO] = opens.to_numpy(dtype=np.float64)
     
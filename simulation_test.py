@@ -12,6 +12,10 @@ def test_update_date():
     account.update_date("2024-01-03")
     assert account.date == "2024-01-03"
 
+    # Test with a Timestamp
+    account.update_date(pd.Timestamp("2024-01-04"))
+    assert account.date == "2024-01-04"
+
     # Test with a date that is not moving forward
     with pytest.raises(ValueError):
         account.update_date("2024-01-02")
@@ -1,7 +1,82 @@
 import pandas as pd
 import numpy as np
+from collections.abc import Mapping
 from data import StockDatabase
 
+
+def build_transition_tables() -> tuple:
+    """
+    Enumerates the entry and exit rules of TradingModel over every encoded pair state
+        state = (position + 1) | sign << 2 | beyond_threshold << 4 | beyond_stop_loss << 5 | delisted << 6,
+    where sign is 0 for a negative spread, 1 for zero, 2 for positive and 3 for NaN,
+    beyond_threshold is |spread| > threshold and beyond_stop_loss is |spread| >= stop_loss.
+    The encoding assumes non-negative thresholds and stop loss levels.
+
+    Returns:
+    exit_table: bool array of whether the open position is exited in each state
+    entry_table: int8 array of the position entered in each state (0 for no entry)
+    position_table: int8 array of the resulting position in each state
+    """
+    exit_table = np.zeros(128, dtype=bool)
+    entry_table = np.zeros(128, dtype=np.int8)
+    position_table = np.zeros(128, dtype=np.int8)
+    for state in range(128):
+        position = (state & 3) - 1
+        sign = (state >> 2) & 3
+        beyond_threshold = (state >> 4) & 1
+        beyond_stop_loss = (state >> 5) & 1
+        delisted = (state >> 6) & 1
+        if position == 2:
+            continue  # unused encoding
+
+        if delisted:
+            # exit any position if one of the stocks is delisted
+            exit_table[state] = position != 0
+        elif position == 1:
+            # exit long position if the spread crosses zero or hits the stop loss
+            exit_table[state] = sign in (1, 2) or (sign == 0 and beyond_stop_loss)
+        elif position == -1:
+            # exit short position if the spread crosses zero or hits the stop loss
+            exit_table[state] = sign in (0, 1) or (sign == 2 and beyond_stop_loss)
+
+        # enter short (long) position if the spread is beyond the threshold but within the stop loss
+        if not delisted and (position == 0 or exit_table[state]) and beyond_threshold and not beyond_stop_loss:
+            entry_table[state] = {0: 1, 2: -1}.get(sign, 0)
+
+        if entry_table[state] != 0:
+            position_table[state] = entry_table[state]
+        elif not exit_table[state]:
+            position_table[state] = position
+    return exit_table, entry_table, position_table
+
+
+class PairView(Mapping):
+    """
+    Dict view {(PERMNO1, PERMNO2): value} of an array aligned with the pairs of a TradingModel,
+    so that the model can keep its per-pair state in arrays. Assigning to an existing pair writes
+    its row of the array, and pairs can't be added or removed.
+    """
+    def __init__(self, pair_index: dict, values: np.ndarray):
+        self.pair_index = pair_index
+        self.values = values
+
+    def __getitem__(self, pair):
+        value = self.values[self.pair_index[pair]]
+        return tuple(value.tolist()) if value.ndim else value.item()
+
+    def __setitem__(self, pair, value):
+        self.values[self.pair_index[pair]] = value
+
+    def __iter__(self):
+        return iter(self.pair_index)
+
+    def __len__(self):
+        return len(self.pair_index)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
 class TradingModel(StockDatabase):
     """
     TradingModel for pairs trading strategy.
@@ -16,13 +91,21 @@ class TradingModel(StockDatabase):
     or exit trades. For example, if the threshold for a pair is 0.5, the model will enter a
     short position when the log spread exceeds 0.5.
 
+    The OLS coefficients, thresholds and stop loss levels are fixed at construction: they are
+    copied into arrays aligned with pairs (alpha_array, beta_array, threshold_array and
+    stop_loss_array), and the given dicts are not kept.
+
     Attributes:
     pairs: list of tuples of PERMNO pairs to trade, e.g. [(PERMNO1, PERMNO2), ...]
-    OLS_coeff: dict of OLS coefficients for each pair, e.g. {(PERMNO1, PERMNO2): (alpha, beta)}
-    threshold: dictionary of thresholds for each pair, e.g. {(PERMNO1, PERMNO2): threshold}
-    stop_loss: dictionary of stop loss levels for each pair, e.g. {(PERMNO1, PERMNO2): stop_loss}
     dollar_per_trade (float): amount of dollar exposure to trade per pair (by default is 1)
+    positions: dict-like view of the position of each pair, e.g. {(PERMNO1, PERMNO2): position},
+    where position = 1 for long, -1 for short, and 0 for no position
+    quantities: dict-like view of the shares held for each pair, e.g. {(PERMNO1, PERMNO2): (quantity1, quantity2)}
+    positions and quantities are PairViews over position_array and quantity_array: assigning to a
+    pair updates the model, but pairs can't be added or removed.
     """
+    # outcome of the entry and exit rules for every encoded pair state, see build_transition_tables
+    TRANSITION_EXIT, TRANSITION_ENTRY, TRANSITION_POSITION = build_transition_tables()
 
     def __init__(self, pairs: list, OLS_coeff: dict, threshold: dict, stop_loss: dict, dollar_per_trade: float = 1):
         """
@@ -39,16 +122,41 @@ class TradingModel(StockDatabase):
         super().__init__()
         self.pairs = pairs
         self.unique_PERMNOs = set([PERMNO for pair in pairs for PERMNO in pair])
-        self.OLS_coeff = OLS_coeff
-        self.threshold = threshold
-        self.stop_loss = stop_loss
         self.dollar_per_trade = dollar_per_trade
 
+        # the per-pair parameters and state are stored as arrays aligned with pairs (structure of
+        # arrays), and pair_index gives the row of each pair
+        self.pair_index = {pair: i for i, pair in enumerate(pairs)}
+        # fixed ordering of the unique PERMNOs, and the rows of the two PERMNOs of each pair in it
+        self.sorted_PERMNOs = tuple(sorted(self.unique_PERMNOs))
+        PERMNO_row = {PERMNO: row for row, PERMNO in enumerate(self.sorted_PERMNOs)}
+        self.pair_rows = np.array([(PERMNO_row[PERMNO1], PERMNO_row[PERMNO2]) for PERMNO1, PERMNO2 in pairs],
+                                  dtype=np.intp).reshape(-1, 2)
+        alpha = np.array([OLS_coeff[pair][0] for pair in pairs], dtype=np.float64)
+        # dollar ratios (1/(1+alpha), alpha/(1+alpha)) of the two legs of each pair, kept in double
+        # precision since they size the trades
+        self.ratio_array = np.column_stack([1 / (1 + alpha), alpha / (1 + alpha)])
+        # the spreads only need to be compared with the thresholds and stop losses, so they are
+        # computed in single precision
+        self.alpha_array = alpha.astype(np.float32)
+        self.beta_array = np.array([OLS_coeff[pair][1] for pair in pairs], dtype=np.float32)
+        self.threshold_array = np.array([threshold[pair] for pair in pairs], dtype=np.float32)
+        self.stop_loss_array = np.array([stop_loss[pair] for pair in pairs], dtype=np.float32)
+
         # initialize positions & quantities for each pair
         # 0 for no position, 1 for long, -1 for short
-        self.positions = {pair: 0 for pair in pairs}
+        self.position_array = np.zeros(len(pairs), dtype=np.int8)
         # number of shares to buy/sell for each PERMNO in the pair
-        self.quantities = {pair: (0,0) for pair in pairs}
+        self.quantity_array = np.zeros((len(pairs), 2), dtype=np.float64)
+        # dict views of the state, e.g. positions[(PERMNO1, PERMNO2)] -> position
+        self.positions = PairView(self.pair_index, self.position_array)
+        self.quantities = PairView(self.pair_index, self.quantity_array)
+        # date of the second-to-last close, date index and raw close/open arrays of each PERMNO,
+        # filled in by load_arrays on first use
+        self.last_close_dates = {}
+        self.date_indexes = {}
+        self.close_arrays = {}
+        self.open_arrays = {}
 
 
     def calc_spreads(self, close_prices: dict) -> dict:
@@ -62,12 +170,51 @@ class TradingModel(StockDatabase):
         Returns:
         spreads: dict of log spreads for each pair, e.g. {(PERMNO1, PERMNO2): spread}
         """
-        spreads = {}
-        for pair in self.pairs:
-            PERMNO1, PERMNO2 = pair
-            alpha, beta = self.OLS_coeff[pair]
-            spread = np.log(close_prices[PERMNO1]) - alpha * np.log(close_prices[PERMNO2]) - beta
-            spreads[pair] = spread
+        return dict(zip(self.pairs, self.calc_spread_array(close_prices).tolist()))
+    
+
+    def calc_spread_array(self, close_prices: dict) -> np.ndarray:
+        """
+        Same as calc_spreads, but returns the log spreads as a float32 array aligned with pairs.
+        """
+        n = len(self.pairs)
+        # read each PERMNO once and gather the prices of both legs of every pair from that vector
+        prices = np.fromiter((close_prices[PERMNO] for PERMNO in self.sorted_PERMNOs), dtype=np.float32,
+                             count=len(self.sorted_PERMNOs))
+        price1 = prices[self.pair_rows[:, 0]]
+        price2 = prices[self.pair_rows[:, 1]]
+
+        # pairs with a missing price are left as NaN rather than carried through the logs
+        valid = ~(np.isnan(price1) | np.isnan(price2))
+        spreads = np.full(n, np.nan, dtype=np.float32)
+        log_price2 = np.empty(n, dtype=np.float32)
+        np.log(price1, out=spreads, where=valid)
+        np.log(price2, out=log_price2, where=valid)
+        np.multiply(self.alpha_array, log_price2, out=log_price2, where=valid)
+        np.subtract(spreads, log_price2, out=spreads, where=valid)
+        np.subtract(spreads, self.beta_array, out=spreads, where=valid)
+        return spreads
+
+
+    def calc_spreads_matrix(self, close_price_matrix: np.ndarray) -> np.ndarray:
+        """
+        Calculates the log spreads of all pairs over many days at once.
+
+        Parameters:
+        close_price_matrix: array of shape (T, K) of the close prices on T days, where the K columns
+        are the PERMNOs in the order of sorted_PERMNOs.
+
+        Returns:
+        spreads: float32 array of shape (T, N) of the log spreads, where the N columns are in the order of pairs.
+        """
+        # every step writes into one of three buffers instead of allocating a temporary array
+        log_prices = np.array(close_price_matrix, dtype=np.float32)
+        np.log(log_prices, out=log_prices)
+        spreads = np.take(log_prices, self.pair_rows[:, 0], axis=1)
+        log_price2 = np.take(log_prices, self.pair_rows[:, 1], axis=1)
+        np.multiply(self.alpha_array, log_price2, out=log_price2)
+        np.subtract(spreads, log_price2, out=spreads)
+        np.subtract(spreads, self.beta_array, out=spreads)
         return spreads
     
 
@@ -84,18 +231,12 @@ class TradingModel(StockDatabase):
         exit a position.
         """
         # get the last close date and price
-        last_close_dates = {}
         close_prices = {}
-        for PERMNO in self.unique_PERMNOs:
-            last_close_dates[PERMNO] = self.get_PERMNO(PERMNO).index[-2].strftime("%Y-%m-%d")
+        close_ts = pd.Timestamp(close_date)
+        for PERMNO in self.sorted_PERMNOs:
+            close_prices[PERMNO] = self.get_point_price(PERMNO, "C", close_ts)
 
-            data = self.get_metrics(PERMNO, ("C"), close_date, close_date)["DlyClose"]
-            if data.empty:
-                close_prices[PERMNO] = np.nan
-            else:
-                close_prices[PERMNO] = data.iloc[0]
-
-        return self.make_decisions_helper(close_date, close_prices, last_close_dates)
+        return self.make_decisions_helper(close_date, close_prices, self.last_close_dates)
     
 
     def trade(self, decisions: list, open_date: str) -> list:
@@ -114,82 +255,160 @@ class TradingModel(StockDatabase):
         the number of shares to buy/sell for PERMNO.
         """
         open_prices = {}
-        for PERMNO in self.unique_PERMNOs:
-            data = self.get_metrics(PERMNO, ("O"), open_date, open_date)["DlyOpen"]
-            if data.empty:
-                open_prices[PERMNO] = np.nan
-            else:
-                open_prices[PERMNO] = data.iloc[0]
+        open_ts = pd.Timestamp(open_date)
+        for PERMNO in self.sorted_PERMNOs:
+            open_prices[PERMNO] = self.get_point_price(PERMNO, "O", open_ts)
 
         return self.trade_helper(decisions, open_prices)
 
 
     # HELPER
+    def load_arrays(self, PERMNO: int) -> None:
+        """
+        Helper method to cache the date index, raw close/open price arrays and last close date of
+        the PERMNO. The price history is static, so this is only done once per PERMNO.
+        """
+        data = self.get_PERMNO(PERMNO)
+        self.date_indexes[PERMNO] = data.index
+        self.close_arrays[PERMNO] = data["DlyClose"].to_numpy(dtype=np.float64)
+        self.open_arrays[PERMNO] = data["DlyOpen"].to_numpy(dtype=np.float64)
+        self.last_close_dates[PERMNO] = data.index[-2]
+
+
+    def get_point_price(self, PERMNO: int, metric: str, date: pd.Timestamp) -> float:
+        """
+        Helper method that returns the close ("C") or open ("O") price of the PERMNO on a single date,
+        or NaN if there is no price on that date. Unlike get_metrics, it doesn't slice a DataFrame.
+        """
+        if PERMNO not in self.date_indexes:
+            self.load_arrays(PERMNO)
+        prices = self.close_arrays if metric == "C" else self.open_arrays
+        # a hashtable probe on the index and a read from the raw array
+        try:
+            return float(prices[PERMNO][self.date_indexes[PERMNO].get_loc(date)])
+        except KeyError:
+            return np.nan
+
+
     def make_decisions_helper(self, close_date: str, close_prices: dict, last_close_dates: dict) -> list:
         """
         Helper method to make decisions based on the current close prices and last close dates.
+        The dates can be given as 'YYYY-MM-DD' strings or as Timestamps.
         """
-        decisions = []
-        spreads = self.calc_spreads(close_prices)
-
-        for pair in self.pairs:
-            if pd.to_datetime(close_date) >= pd.to_datetime(last_close_dates[pair[0]]) or pd.to_datetime(close_date) >= pd.to_datetime(last_close_dates[pair[1]]):
-                if self.positions[pair] != 0:
-                    # exit position if one of the stocks is delisted
-                    decisions.append((pair, 0))
-                    self.positions[pair] = 0
-                continue
-            
-            current_spread = spreads[pair]
+        # the spread array goes straight into the decision masks, without a dict in between
+        return self.make_decisions_from_spreads(close_date, self.calc_spread_array(close_prices), last_close_dates)
+
+
+    def make_decisions_from_spreads(self, close_date: str, spreads: np.ndarray, last_close_dates: dict) -> list:
+        """
+        Same as make_decisions_helper, but from the log spreads aligned with pairs, e.g. a row of
+        calc_spreads_matrix, instead of the close prices.
+        """
+        # check each PERMNO once, only parsing the last close dates that are not Timestamps already
+        close_date = pd.Timestamp(close_date)
+        delisted_PERMNOs = np.zeros(len(self.sorted_PERMNOs), dtype=bool)
+        for row, PERMNO in enumerate(self.sorted_PERMNOs):
+            date = last_close_dates[PERMNO]
+            delisted_PERMNOs[row] = close_date >= (date if isinstance(date, pd.Timestamp) else pd.Timestamp(date))
+        # a pair is delisted if either of its rows is
+        delisted = delisted_PERMNOs[self.pair_rows].any(axis=1)
+
+        return self.decide(spreads, delisted)
 
-            if self.positions[pair] == 1:
-                if current_spread >= 0 or current_spread <= -self.stop_loss[pair]:
-                    # Exit long position (either spread crosses zero or hits stop loss)
-                    decisions.append((pair, 0))
-                    self.positions[pair] = 0
-    
-            if self.positions[pair] == -1:
-                if current_spread <= 0 or current_spread >= self.stop_loss[pair]:
-                    # Exit short position (either spread crosses zero or hits stop loss)
-                    decisions.append((pair, 0))
-                    self.positions[pair] = 0
-            
-            if self.positions[pair] == 0:
-                if current_spread > self.threshold[pair] and current_spread < self.stop_loss[pair]:
-                    # Enter short position
-                    decisions.append((pair, -1))
-                    self.positions[pair] = -1
-                    
-                elif current_spread < -self.threshold[pair] and current_spread > -self.stop_loss[pair]:
-                    # Enter long position
-                    decisions.append((pair, 1))
-                    self.positions[pair] = 1
 
+    def decide(self, spreads: np.ndarray, delisted: np.ndarray) -> list:
+        """
+        Helper method that applies the entry and exit rules to all pairs at once, given the
+        pair-aligned spreads and delisted flags. Updates the positions and returns the decisions
+        in pair order, with an exit listed before an entry of the same pair.
+        """
+        # encode the state of each pair and look up its transition, instead of branching on it
+        abs_spreads = np.abs(spreads)
+        sign = np.where(np.isnan(spreads), 3, (spreads == 0) + 2 * (spreads > 0))
+        states = ((self.position_array + 1) | sign << 2 | (abs_spreads > self.threshold_array) << 4
+                  | (abs_spreads >= self.stop_loss_array) << 5 | delisted << 6)
+        exits = self.TRANSITION_EXIT[states]
+        entries = self.TRANSITION_ENTRY[states]
+        self.position_array[:] = self.TRANSITION_POSITION[states]
+
+        decisions = []
+        for i in np.flatnonzero(exits | (entries != 0)):
+            pair = self.pairs[i]
+            if exits[i]:
+                decisions.append((pair, 0))
+            if entries[i]:
+                decisions.append((pair, int(entries[i])))
         return decisions
 
 
     def trade_helper(self, decisions: list, open_prices: dict) -> list:
         """
         Helper method to execute trades based on the decisions and current open prices.
+        The decisions are executed in the given order. They are batched when they are in the
+        order make_decisions returns them, i.e. in pair order with at most one exit followed by
+        at most one entry per pair, and otherwise executed one at a time by trade_in_order.
+        """
+        n = len(decisions)
+        rows = np.fromiter((self.pair_index[pair] for pair, _ in decisions), dtype=np.intp, count=n)
+        exits = np.fromiter((position == 0 for _, position in decisions), dtype=bool, count=n)
+        # the keys 2 * row for an exit and 2 * row + 1 for an entry are strictly increasing exactly
+        # when the decisions are in that order, so that batching all exits first is safe
+        keys = 2 * rows + ~exits
+        if np.any(keys[1:] <= keys[:-1]):
+            return self.trade_in_order(decisions, open_prices)
+
+        # row k holds the quantities of the two PERMNOs traded for decision k
+        quantities = np.empty((n, 2), dtype=np.float64)
+
+        # exit positions: negate and reset the quantities of all exited pairs at once
+        exit_rows = rows[exits]
+        quantities[exits] = -self.quantity_array[exit_rows]
+        self.quantity_array[exit_rows] = 0
+
+        # enter long or short positions: size all entered pairs at once
+        entries = np.flatnonzero(~exits)
+        entry_rows = rows[entries]
+        entry_positions = np.fromiter((decisions[k][1] for k in entries.tolist()), dtype=np.float64,
+                                      count=len(entries))
+        entry_prices = np.fromiter((open_prices[PERMNO] for k in entries.tolist() for PERMNO in decisions[k][0]),
+                                   dtype=np.float64, count=2 * len(entries)).reshape(-1, 2)
+        entry_quantities = entry_positions[:, None] * self.ratio_array[entry_rows] * self.dollar_per_trade
+        entry_quantities /= entry_prices
+        entry_quantities[:, 1] *= -1
+        quantities[entries] = entry_quantities
+        self.quantity_array[entry_rows] = entry_quantities
+
+        trades = []
+        for ((PERMNO1, PERMNO2), _), (quantity1, quantity2) in zip(decisions, quantities.tolist()):
+            trades.append((PERMNO1, quantity1))
+            trades.append((PERMNO2, quantity2))
+        return trades
+
+
+    def trade_in_order(self, decisions: list, open_prices: dict) -> list:
+        """
+        Helper method to execute the decisions one at a time, in the given order, so that an exit
+        after an entry of the same pair (or a repeated exit) trades the quantities held at that point.
         """
         trades = []
 
         for pair, position in decisions:
             PERMNO1, PERMNO2 = pair
+            i = self.pair_index[pair]
             
             if position == 0:
                 # exit position
-                trades.append((PERMNO1, -self.quantities[pair][0]))
-                trades.append((PERMNO2, -self.quantities[pair][1]))
-                self.quantities[pair] = (0, 0)  # reset quantities
+                quantity1, quantity2 = self.quantity_array[i].tolist()
+                trades.append((PERMNO1, -quantity1))
+                trades.append((PERMNO2, -quantity2))
+                self.quantity_array[i] = 0  # reset quantities
             else:
                 # enter long or short position
-                ratio1 = 1 / (1 + self.OLS_coeff[pair][0])
-                ratio2 = self.OLS_coeff[pair][0] / (1 + self.OLS_coeff[pair][0])
+                ratio1, ratio2 = self.ratio_array[i].tolist()
                 quantity1 = (position * ratio1 * self.dollar_per_trade) / open_prices[PERMNO1]
                 quantity2 = -(position * ratio2 * self.dollar_per_trade) / open_prices[PERMNO2]
                 trades.append((PERMNO1, quantity1))
                 trades.append((PERMNO2, quantity2))
-                self.quantities[pair] = (quantity1, quantity2)
+                self.quantity_array[i] = (quantity1, quantity2)
         return trades
     
\ No newline at end of file
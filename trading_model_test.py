@@ -68,6 +68,32 @@ def test_calc_spreads_3():
             assert np.isclose(spread[pair], expected_spread[pair]), f"Failed for pair {pair}: {spread[pair]} != {expected_spread[pair]}"
 
 
+def test_calc_spreads_matrix():
+    # spreads over several days match the daily calc_spreads, including a missing price
+    pairs = [(1, 2), (3, 4), (2, 3)]
+    OLS_coeff = {pairs[0]: (1, 0.5), 
+                 pairs[1]: (1.5, 0.3),
+                 pairs[2]: (0.8, -0.1)}
+    threshold = {pair: 1 for pair in pairs}
+    stop_loss = {pair: 2 for pair in pairs}
+    model = TradingModel(pairs, OLS_coeff, threshold, stop_loss)
+    daily_close_prices = [{1: 10, 2: 15, 3: 20, 4: 30},
+                          {1: 11, 2: 14, 3: np.nan, 4: 31},
+                          {1: 12, 2: 16, 3: 19, 4: 29}]
+    close_price_matrix = np.array([[close_prices[PERMNO] for PERMNO in model.sorted_PERMNOs]
+                                   for close_prices in daily_close_prices], dtype=float)
+
+    spreads = model.calc_spreads_matrix(close_price_matrix)
+    assert spreads.shape == (3, 3), f"Expected shape (3, 3), got {spreads.shape}"
+    for t, close_prices in enumerate(daily_close_prices):
+        expected_spread = model.calc_spreads(close_prices)
+        for j, pair in enumerate(pairs):
+            if np.isnan(expected_spread[pair]):
+                assert np.isnan(spreads[t, j]), f"Expected NaN for pair {pair} on day {t}, got {spreads[t, j]}"
+            else:
+                assert np.isclose(spreads[t, j], expected_spread[pair]), f"Failed for pair {pair} on day {t}: {spreads[t, j]} != {expected_spread[pair]}"
+
+
 def test_make_decisions_1():
     # Create the TradingModel
     pairs = [(1, 2), (3, 4)]
@@ -455,3 +481,55 @@ def test_trade_2():
     trades = model.trade_helper(decisions, open_prices)
     assert trades == [], "Expected no trades when no thresholds are crossed"
 
+
+def test_trade_3():
+    # decisions that are not in the order make_decisions returns them are executed in the given order
+    pairs = [(1, 2)]
+    OLS_coeff = {pairs[0]: (1, 0)}
+    threshold = {pair: 1 for pair in pairs}
+    stop_loss = {pair: 2 for pair in pairs}
+    model = TradingModel(pairs, OLS_coeff, threshold, stop_loss)
+    open_prices = {1: 10,
+                   2: 10}
+
+    # Test 1: entry then exit of the same pair closes the entered position
+    decisions = [(pairs[0], 1), (pairs[0], 0)]
+    trades = model.trade_helper(decisions, open_prices)
+    expected_trades = [(pairs[0][0], 0.05), (pairs[0][1], -0.05),
+                       (pairs[0][0], -0.05), (pairs[0][1], 0.05)]
+    assert trades == expected_trades, f"Expected {expected_trades}, got {trades}"
+    assert model.quantities[pairs[0]] == (0, 0), f"Expected no quantities held, got {model.quantities[pairs[0]]}"
+
+    # Test 2: a repeated exit only sells the position once
+    model.trade_helper([(pairs[0], 1)], open_prices)
+    decisions = [(pairs[0], 0), (pairs[0], 0)]
+    trades = model.trade_helper(decisions, open_prices)
+    expected_trades = [(pairs[0][0], -0.05), (pairs[0][1], 0.05),
+                       (pairs[0][0], 0), (pairs[0][1], 0)]
+    assert trades == expected_trades, f"Expected {expected_trades}, got {trades}"
+    assert model.quantities[pairs[0]] == (0, 0), f"Expected no quantities held, got {model.quantities[pairs[0]]}"
+
+
+def test_set_positions():
+    # positions and quantities assigned through the dict views are used by the model
+    pairs = [(1, 2)]
+    OLS_coeff = {pairs[0]: (1, 0)}
+    threshold = {pair: 1 for pair in pairs}
+    stop_loss = {pair: 2 for pair in pairs}
+    model = TradingModel(pairs, OLS_coeff, threshold, stop_loss)
+    model.positions[pairs[0]] = 1
+    model.quantities[pairs[0]] = (0.05, -0.05)
+    assert model.positions[pairs[0]] == 1, f"Expected position 1, got {model.positions[pairs[0]]}"
+
+    # exit the long position because the spread crossed zero
+    close_prices = {1: 10,
+                    2: 5}
+    last_close_dates = {1: "2024-01-01",
+                        2: "2024-01-01"}
+    decisions = model.make_decisions_helper("2023-01-01", close_prices, last_close_dates)
+    expected_decisions = [(pairs[0], 0)]
+    assert decisions == expected_decisions, f"Expected {expected_decisions}, got {decisions}"
+
+    trades = model.trade_helper(decisions, {1: 10, 2: 5})
+    expected_trades = [(pairs[0][0], -0.05), (pairs[0][1], 0.05)]
+    assert trades == expected_trades, f"Expected {expected_trades}, got {trades}"